@@ -4,29 +4,219 @@ from __future__ import annotations
 import argparse
 import json
 import math
+import os
+import sqlite3
+from collections import Counter
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
 
 import faiss
+import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
 
+try:
+    import orjson  # several times faster than stdlib json on the per-row hot loop
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
 
-def load_jsonl(path: Path) -> List[Dict[str, Any]]:
-    out: List[Dict[str, Any]] = []
-    with path.open("r", encoding="utf-8") as f:
+# IVFPQ settings: M sub-quantizers of NBITS each -> M bytes per stored vector.
+PQ_M = 16
+PQ_NBITS = 8
+# k-means wants ~39 points per centroid; below this the PQ codebooks are poorly trained.
+PQ_MIN_TRAIN = 39 * (1 << PQ_NBITS)
+# Chunks are streamed through in windows of batch_size * WINDOW_BATCHES and length-sorted
+# within each window: bounded memory, most of the padding savings of a global sort.
+WINDOW_BATCHES = 16
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def json_dumps_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def load_jsonl(path: Path, start: int, follow: bool, stats: Counter) -> Iterator[Dict[str, Any]]:
+    """
+    Yields rows after byte offset `start`, tracking the end of the last consumed line
+    in stats["offset"]. With `follow` the fetch stage is still writing, so a final line
+    without its newline is left (and counted in stats["held_bytes"]) for the next run.
+    """
+    stats["offset"] = start
+    with path.open("rb") as f:
+        f.seek(start)
         for line in f:
+            if follow and not line.endswith(b"\n"):
+                stats["held_bytes"] = len(line)
+                break
+            stats["offset"] += len(line)
             line = line.strip()
             if not line:
                 continue
-            out.append(json.loads(line))
-    return out
+            yield json_loads(line)
+
+
+def iter_docs(path: Path, start: int, follow: bool, stats: Counter) -> Iterator[Dict[str, Any]]:
+    for r in load_jsonl(path, start, follow, stats):
+        stats["rows"] += 1
+        text = r.get("text")
+        if not isinstance(text, str):
+            continue
+        text = text.strip()
+
+        # keep the minimal fields you need to show citations
+        yield {
+            "doc_id": r.get("doc_id"),
+            "species_id": r.get("species_id"),
+            "title": r.get("title"),
+            "url": r.get("url"),
+            "section": r.get("section", "unknown"),
+            "text": text,
+        }
+
+
+def batched(items: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def drop_short(window: List[Dict[str, Any]], min_chars: int) -> List[Dict[str, Any]]:
+    """
+    Keeps docs whose text has at least min_chars characters, as one mask over the window.
+    """
+    docs = np.empty(len(window), dtype=object)
+    docs[:] = window
+    lengths = np.fromiter((len(doc["text"]) for doc in window), dtype=np.int64, count=len(window))
+    return docs[lengths >= min_chars].tolist()
+
+
+META_COLUMNS = ("doc_id", "species_id", "title", "url", "section", "text")
+
+
+def open_meta_db(path: Path) -> sqlite3.Connection:
+    """
+    SQLite table keyed by FAISS row id, so the server can fetch metadata for just
+    the k hits instead of holding every chunk in memory.
+    """
+    conn = sqlite3.connect(str(path))
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS chunks ("
+        "row_id INTEGER PRIMARY KEY, doc_id TEXT, species_id TEXT, title TEXT, url TEXT, section TEXT, text TEXT)"
+    )
+    return conn
+
+
+def load_build_state(path: Path) -> Dict[str, Any]:
+    """
+    How far previous runs got: input bytes consumed, rows embedded, vector dim and
+    chunks.jsonl size. Everything past these marks is from an interrupted run.
+    indexed_rows is only set once a full shard set covering that many rows is in place.
+    """
+    state: Dict[str, Any] = {"input_offset": 0, "rows": 0, "dim": None, "meta_bytes": 0, "indexed_rows": 0}
+    if path.exists():
+        state.update(json_loads(path.read_bytes()))
+    return state
+
 
+def save_build_state(path: Path, state: Dict[str, Any]) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(json_dumps_bytes(state))
+    os.replace(tmp, path)
 
-def write_jsonl(path: Path, rows: List[Dict[str, Any]]) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
-        for r in rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+def inference_context(model: SentenceTransformer) -> ExitStack:
+    """
+    No autograd bookkeeping, plus fp16 autocast on CUDA. CPUs keep fp32: bf16 autocast
+    is only faster on CPUs with native bf16 units and torch does not expose a check for
+    them (the int8 ONNX export is the CPU fast path).
+    """
+    stack = ExitStack()
+    stack.enter_context(torch.inference_mode())
+    if model.device.type == "cuda":
+        stack.enter_context(torch.autocast(device_type="cuda", dtype=torch.float16))
+    return stack
+
+
+def embed_window(model: SentenceTransformer, texts: List[str], batch_size: int) -> np.ndarray:
+    """
+    Encodes texts in length-sorted batches so each batch pads to a similar length,
+    writing each embedding straight into its original row of the window matrix.
+    """
+    vectors: Optional[np.ndarray] = None
+    order = np.argsort([len(t) for t in texts], kind="stable")
+    with inference_context(model):
+        for i in range(0, len(texts), batch_size):
+            idx = order[i : i + batch_size]
+            batch = [texts[j] for j in idx]
+            emb = model.encode(
+                batch,
+                batch_size=len(batch),
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            )
+            if vectors is None:
+                # Allocate once the first batch tells us the output dim; some models
+                # report None from get_sentence_embedding_dimension().
+                vectors = np.empty((len(texts), emb.shape[1]), dtype=np.float32)
+            # Autocast batches come back fp16; the assignment upcasts to the fp32 FAISS expects.
+            vectors[idx] = emb
+
+    assert vectors is not None, "embed_window() needs at least one text"
+    return vectors
+
+
+def train_index(vectors: np.ndarray, exact: bool) -> faiss.Index:
+    """
+    Returns a trained, empty index. Cosine similarity == inner product because the
+    vectors are L2-normalized.
+
+    Default is IVFPQ (compressed codes, sub-linear search); `exact` or a corpus too
+    small to train the quantizers falls back to a brute-force scan over fp16 codes,
+    which halves memory and scan bandwidth vs IndexFlatIP at negligible recall cost.
+    """
+    n, dim = vectors.shape
+
+    if not exact and (n < PQ_MIN_TRAIN or dim % PQ_M != 0):
+        print(f"Too few vectors ({n}) or dim {dim} not divisible by M={PQ_M}; using exact fp16 index.")
+        exact = True
+
+    if exact:
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors[: min(n, 100_000)])
+        return index
+
+    nlist = max(1, int(math.sqrt(n)))
+    quantizer = faiss.IndexFlatIP(dim)
+    index = faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_M, PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+    print(f"Training IVFPQ (nlist={nlist}, M={PQ_M}, nbits={PQ_NBITS}) on {n} vectors...")
+    index.train(vectors)
+    return index
+
+
+def build_shards(trained: faiss.Index, vectors: np.ndarray, nshards: int) -> List[faiss.Index]:
+    """
+    Splits vectors into contiguous slices, each added to its own copy of the trained
+    index. Loaded back under IndexShards(successive_ids=True), shard i's local ids are
+    offset by the sizes of shards 0..i-1, so global ids still match metadata rows.
+    """
+    shards: List[faiss.Index] = []
+    for part in np.array_split(vectors, max(1, min(nshards, len(vectors)))):
+        shard = faiss.clone_index(trained)
+        shard.add(part)
+        shards.append(shard)
+    return shards
 
 
 def main():
@@ -36,6 +226,24 @@ def main():
     ap.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
     ap.add_argument("--batch-size", type=int, default=64)
     ap.add_argument("--min-chars", type=int, default=200)
+    ap.add_argument("--max-seq-length", type=int, default=256, help="Token limit per chunk for the encoder.")
+    ap.add_argument("--exact", action="store_true", help="Build a brute-force fp16 index instead of IVFPQ.")
+    ap.add_argument(
+        "--shards",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of index shards searched in parallel by the server (default: CPU count).",
+    )
+    ap.add_argument(
+        "--append",
+        action="store_true",
+        help="Only embed input lines added since the last run, then rebuild the index from all stored vectors.",
+    )
+    ap.add_argument(
+        "--follow",
+        action="store_true",
+        help="Input is still being written: leave an incomplete last line for the next --append run.",
+    )
     args = ap.parse_args()
 
     in_path = Path(args.in_path)
@@ -45,65 +253,101 @@ def main():
     if not in_path.exists():
         raise SystemExit(f"Missing input: {in_path}")
 
-    rows = load_jsonl(in_path)
+    meta_path = out_dir / "chunks.jsonl"
+    db_path = out_dir / "chunks.sqlite"
+    # Raw float32 embeddings, one row per chunk in FAISS id order. Kept between runs so
+    # --append only pays for new chunks; the index itself is always rebuilt from it.
+    vectors_path = out_dir / "vectors.f32"
+    state_path = out_dir / "build_state.json"
 
-    # Filter
-    docs: List[Dict[str, Any]] = []
-    texts: List[str] = []
-    for r in rows:
-        text = r.get("text")
-        if not isinstance(text, str):
-            continue
-        text = text.strip()
-        if len(text) < args.min_chars:
-            continue
+    if not args.append:
+        for path in (meta_path, db_path, vectors_path, state_path):
+            if path.exists():
+                path.unlink()
 
-        # keep the minimal fields you need to show citations
-        doc = {
-            "doc_id": r.get("doc_id"),
-            "species_id": r.get("species_id"),
-            "title": r.get("title"),
-            "url": r.get("url"),
-            "section": r.get("section", "unknown"),
-            "text": text,
-        }
-        docs.append(doc)
-        texts.append(text)
+    state = load_build_state(state_path)
+    n = state["rows"]
+    dim = state["dim"]
 
-    print(f"Loaded {len(rows)} rows, kept {len(docs)} chunks after filtering.")
+    # Roll back anything an interrupted run wrote past the last saved state.
+    if vectors_path.exists():
+        os.truncate(vectors_path, n * (dim or 0) * 4)
+    if meta_path.exists():
+        os.truncate(meta_path, state["meta_bytes"])
+    db = open_meta_db(db_path)
+    db.execute("DELETE FROM chunks WHERE row_id >= ?", (n,))
+    db.commit()
 
     model = SentenceTransformer(args.model)
+    model.max_seq_length = args.max_seq_length
 
-    # Embed in batches
-    emb_list: List[List[float]] = []
-    total = len(texts)
-    for i in range(0, total, args.batch_size):
-        batch = texts[i : i + args.batch_size]
-        emb = model.encode(batch, normalize_embeddings=True, show_progress_bar=False)
-        emb_list.append(emb)
+    # Single pass: filter -> write metadata row -> embed, one window at a time.
+    stats: Counter = Counter()
+    placeholders = ", ".join("?" * (len(META_COLUMNS) + 1))
+    insert_sql = f"INSERT INTO chunks (row_id, {', '.join(META_COLUMNS)}) VALUES ({placeholders})"
+    with vectors_path.open("ab") as vec_f, meta_path.open("ab") as meta_f:
+        docs = iter_docs(in_path, state["input_offset"], args.follow, stats)
+        for window in batched(docs, args.batch_size * WINDOW_BATCHES):
+            window = drop_short(window, args.min_chars)
+            if not window:
+                continue
+            texts = [doc["text"] for doc in window]
+            emb = embed_window(model, texts, args.batch_size)
+            if dim is None:
+                dim = emb.shape[1]
+            elif emb.shape[1] != dim:
+                raise SystemExit(f"Model output dim {emb.shape[1]} != stored dim {dim}; rebuild without --append.")
 
-        done = min(i + args.batch_size, total)
-        if done % 500 == 0 or done == total:
-            print(f"Embedded {done}/{total}")
+            vec_f.write(emb.tobytes())
+            for doc in window:
+                meta_f.write(json_dumps_bytes(doc) + b"\n")
+            # row_id == position in the FAISS index (rows are added in this order).
+            db.executemany(
+                insert_sql,
+                [(n + i, *(doc[c] for c in META_COLUMNS)) for i, doc in enumerate(window)],
+            )
+            vec_f.flush()
+            meta_f.flush()
+            db.commit()
 
-    import numpy as np
+            n += len(window)
+            state.update(input_offset=stats["offset"], rows=n, dim=dim, meta_bytes=meta_f.tell())
+            save_build_state(state_path, state)
+            print(f"Embedded {n} chunks ({stats['rows']} rows read)")
 
-    vectors = np.vstack(emb_list).astype("float32")
-    dim = vectors.shape[1]
-    print(f"Vector shape: {vectors.shape} (dim={dim})")
+    db.close()
+    state["input_offset"] = stats["offset"]
+    save_build_state(state_path, state)
 
-    # FAISS cosine similarity = inner product if vectors are normalized
-    index = faiss.IndexFlatIP(dim)
-    index.add(vectors)
+    print(f"Loaded {stats['rows']} new rows; {n} chunks stored after filtering.")
+    if stats["held_bytes"]:
+        print(f"Left {stats['held_bytes']} trailing bytes (incomplete last line) for the next run.")
+    if n == 0:
+        raise SystemExit("No chunks left after filtering; nothing to index.")
+    if args.append and state["indexed_rows"] == n:
+        print("No new chunks; index unchanged.")
+        return
 
-    faiss_path = out_dir / "faiss.index"
-    meta_path = out_dir / "chunks.jsonl"
+    vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(n, dim))
+    print(f"Vector shape: {vectors.shape} (dim={dim})")
+
+    trained = train_index(vectors, exact=args.exact)
+    shards = build_shards(trained, vectors, args.shards)
 
-    faiss.write_index(index, str(faiss_path))
-    write_jsonl(meta_path, docs)
+    # Write the new set under temp names first so a crash never leaves a partial set
+    # in place; indexed_rows is only recorded once every shard has been swapped in.
+    shard_paths = [out_dir / f"faiss.shard{i:03d}.index" for i in range(len(shards))]
+    for shard, path in zip(shards, shard_paths):
+        faiss.write_index(shard, str(path.with_name(path.name + ".tmp")))
+    for path in shard_paths:
+        os.replace(path.with_name(path.name + ".tmp"), path)
+    for stale in set(out_dir.glob("faiss.shard*.index")) - set(shard_paths):
+        stale.unlink()
+    state["indexed_rows"] = n
+    save_build_state(state_path, state)
 
-    print(f"Saved index: {faiss_path}")
-    print(f"Saved metadata: {meta_path}")
+    print(f"Saved index: {len(shards)} shards in {out_dir}")
+    print(f"Saved metadata: {db_path} (JSONL copy: {meta_path})")
     print("Done.")
 
 
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+One-time export of the query encoder to ONNX Runtime with int8 dynamic quantization.
+
+Output: data/index/encoder-onnx/ (model_quantized.onnx + tokenizer/config)
+
+The retrieval server picks this up automatically when present and falls back to the
+fp32 SentenceTransformer otherwise. Requires: pip install "optimum[onnxruntime]"
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
+
+QUANT_CONFIGS = {
+    "avx512_vnni": AutoQuantizationConfig.avx512_vnni,
+    "avx2": AutoQuantizationConfig.avx2,
+    "arm64": AutoQuantizationConfig.arm64,
+}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Export + int8-quantize the query encoder for ONNX Runtime.")
+    ap.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    ap.add_argument("--out-dir", default="data/index/encoder-onnx")
+    ap.add_argument(
+        "--arch",
+        choices=sorted(QUANT_CONFIGS),
+        default="avx512_vnni",
+        help="Target CPU instruction set for the int8 kernels (default avx512_vnni).",
+    )
+    args = ap.parse_args()
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    model = ORTModelForFeatureExtraction.from_pretrained(args.model, export=True)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+
+    # Dynamic quantization: int8 weights, activations quantized on the fly (no calibration set).
+    qconfig = QUANT_CONFIGS[args.arch](is_static=False, per_channel=False)
+    quantizer = ORTQuantizer.from_pretrained(model)
+    quantizer.quantize(save_dir=out_dir, quantization_config=qconfig)
+
+    model.config.save_pretrained(out_dir)
+    tokenizer.save_pretrained(out_dir)
+    print(f"Saved int8 encoder: {out_dir / 'model_quantized.onnx'}")
+
+
+if __name__ == "__main__":
+    main()
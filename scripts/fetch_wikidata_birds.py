@@ -2,33 +2,67 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import json
+import os
 import random
 import re
 import sys
 import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
-import requests
+import aiohttp
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
 
 QID_RE = re.compile(r"\bQ[1-9]\d*\b")
 ENTITY_URL = "https://www.wikidata.org/wiki/Special:EntityData/{qid}.json"
 USER_AGENT = "GioBirdRAG/0.1 (local educational project)"
 
+DEFAULT_CONCURRENCY = 32
+# Output/state lines buffered between flushes (+ state fsync) in the writer.
+FLUSH_EVERY = 100
+
 P_SCI_NAME = "P225"
 P_IUCN = "P141"
 P_PARENT = "P171"
 P_RANK = "P105"
 
 
+def json_loads(data: Union[str, bytes]) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def json_dumps(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def json_dumps_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
 def qid_from_url(url: str) -> Optional[str]:
+    # Fast path: WDQS entity URLs end in "/Q<digits>", which a few C-level str
+    # checks can confirm without going through the regex engine.
+    tail = url.rpartition("/")[2]
+    digits = tail[1:]
+    if tail[:1] == "Q" and digits[:1] not in ("", "0") and digits.isascii() and digits.isdigit():
+        return tail
+
     m = QID_RE.search(url)
     return m.group(0) if m else None
 
 
 def load_qids_from_row_array_json(path: Path) -> List[str]:
-    rows = json.loads(path.read_text(encoding="utf-8"))
+    rows = json_loads(path.read_bytes())
     qids: List[str] = []
     for row in rows:
         if not isinstance(row, dict):
@@ -139,56 +173,280 @@ def normalize_entity_to_rag_doc(qid: str, entity: Dict[str, Any]) -> Dict[str, A
     }
 
 
-def fetch_entity_with_backoff(qid: str, session: requests.Session, max_retries: int = 8) -> Dict[str, Any]:
+class RateLimiter:
+    """
+    Token bucket shared by all fetch workers, so the aggregate request rate stays at `rps`
+    no matter how many requests are in flight.
+    """
+
+    def __init__(self, rps: float, burst: int = 1) -> None:
+        self.rate = max(rps, 0.1)
+        self.capacity = float(max(burst, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+
+async def fetch_entity_with_backoff_async(
+    qid: str,
+    session: aiohttp.ClientSession,
+    limiter: RateLimiter,
+    max_retries: int = 8,
+) -> Dict[str, Any]:
     """
     Retries on 429/503/502 with exponential backoff and respects Retry-After if provided.
+    Backoff awaits asyncio.sleep, so other in-flight fetches keep running while this one waits.
     """
     url = ENTITY_URL.format(qid=qid)
     backoff = 1.0
+    last_status = None
 
     for attempt in range(max_retries + 1):
-        r = session.get(url, timeout=30)
+        await limiter.acquire()
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as r:
+            last_status = r.status
 
-        if r.status_code == 200:
-            return r.json()
+            if r.status == 200:
+                return await r.json(content_type=None, loads=json_loads)
+
+            if r.status not in (429, 502, 503):
+                # other errors: raise immediately
+                r.raise_for_status()
+                continue
 
-        if r.status_code in (429, 502, 503):
             retry_after = r.headers.get("Retry-After")
-            if retry_after:
-                try:
-                    wait = float(retry_after)
-                except ValueError:
-                    wait = backoff
-            else:
+
+        if retry_after:
+            try:
+                wait = float(retry_after)
+            except ValueError:
                 wait = backoff
+        else:
+            wait = backoff
 
-            # jitter helps avoid synchronized retries
-            wait = wait + random.random() * 0.5
-            time.sleep(wait)
-            backoff = min(backoff * 2, 60.0)
-            continue
+        # jitter helps avoid synchronized retries
+        wait = wait + random.random() * 0.5
+        await asyncio.sleep(wait)
+        backoff = min(backoff * 2, 60.0)
+
+    raise RuntimeError(f"Exceeded retries for {qid} (last status={last_status})")
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """
+    Writes via a temp file + rename, so an interrupted write never leaves a truncated file behind.
+    """
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
 
-        # other errors: raise immediately
-        r.raise_for_status()
 
-    raise RuntimeError(f"Exceeded retries for {qid} (last status={r.status_code})")
+async def fetch_entity(
+    qid: str,
+    session: aiohttp.ClientSession,
+    limiter: RateLimiter,
+    raw_dir: Path,
+) -> Dict[str, Any]:
+    raw_path = raw_dir / f"{qid}.json"
+    if raw_path.exists():
+        return json_loads(raw_path.read_bytes())
+
+    payload = await fetch_entity_with_backoff_async(qid, session, limiter)
+    write_atomic(raw_path, json_dumps_bytes(payload))
+    return payload
 
 
 def load_state(state_file: Path) -> Set[str]:
+    """
+    Reads the done-log (one id per line). State files from before the append-only
+    format are a single JSON list and are still accepted.
+
+    A crash can leave a torn last line (possibly cut inside a multi-byte character);
+    it is dropped, and the id simply gets redone. A file that cannot be read at all
+    exits instead of returning an empty set, which the startup compaction would
+    otherwise write over the log.
+    """
     if not state_file.exists():
         return set()
-    try:
-        data = json.loads(state_file.read_text(encoding="utf-8"))
-        if isinstance(data, list):
-            return set(x for x in data if isinstance(x, str))
-    except Exception:
-        pass
-    return set()
+    data = state_file.read_bytes()
+    if data.lstrip().startswith(b"["):
+        try:
+            items = json_loads(data)
+        except ValueError as e:
+            print(f"Unreadable state file {state_file}: {e}", file=sys.stderr)
+            sys.exit(1)
+        return set(x for x in items if isinstance(x, str)) if isinstance(items, list) else set()
+
+    lines = data.split(b"\n")
+    lines.pop()  # "" after the final newline, or the torn last line
+    done = set()
+    for line in lines:
+        key = line.decode("utf-8", errors="replace").strip()
+        if key:
+            done.add(key)
+    return done
 
 
 def save_state(state_file: Path, done: Set[str]) -> None:
+    """
+    Compacts the done-log: rewrites it as one deduped id per line, atomically.
+    """
     state_file.parent.mkdir(parents=True, exist_ok=True)
-    state_file.write_text(json.dumps(sorted(done)), encoding="utf-8")
+    tmp = state_file.with_name(state_file.name + ".tmp")
+    tmp.write_text("".join(f"{x}\n" for x in sorted(done)), encoding="utf-8")
+    os.replace(tmp, state_file)
+
+
+class StateLog:
+    """
+    Append-only done-log: each finished id costs one short write instead of
+    re-serializing the whole set. The writer calls sync() right after flushing the
+    output those ids refer to, so the log never runs ahead of the data on disk.
+    """
+
+    def __init__(self, state_file: Path) -> None:
+        state_file.parent.mkdir(parents=True, exist_ok=True)
+        self.f = state_file.open("a", encoding="utf-8")
+
+    def append(self, key: str) -> None:
+        self.f.write(key + "\n")
+
+    def sync(self) -> None:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self) -> None:
+        self.sync()
+        self.f.close()
+
+
+async def fetch_worker(
+    queue: "asyncio.Queue[Optional[str]]",
+    results: "asyncio.Queue[Optional[Tuple[str, Optional[Dict[str, Any]], Optional[Exception]]]]",
+    session: aiohttp.ClientSession,
+    limiter: RateLimiter,
+    raw_dir: Path,
+) -> None:
+    while True:
+        qid = await queue.get()
+        if qid is None:
+            return
+        try:
+            payload = await fetch_entity(qid, session, limiter, raw_dir)
+
+            entity = payload.get("entities", {}).get(qid)
+            if not isinstance(entity, dict):
+                raise RuntimeError("Missing entity in response")
+
+            await results.put((qid, normalize_entity_to_rag_doc(qid, entity), None))
+        except Exception as e:
+            await results.put((qid, None, e))
+
+
+async def write_results(
+    results: "asyncio.Queue[Optional[Tuple[str, Optional[Dict[str, Any]], Optional[Exception]]]]",
+    out_path: Path,
+    state_log: StateLog,
+    done: Set[str],
+    total: int,
+    skipped: int,
+) -> Tuple[int, int]:
+    """
+    Single writer: the only coroutine touching the output JSONL and the state file,
+    so lines are never interleaved regardless of how many fetches are in flight.
+    """
+    written = 0
+    failed = 0
+    handled = skipped
+    unflushed = 0
+
+    with out_path.open("a", encoding="utf-8") as f:
+        while True:
+            item = await results.get()
+            if item is None:
+                break
+            qid, doc, err = item
+            handled += 1
+
+            if err is not None:
+                failed += 1
+                print(f"FAILED {qid}: {err}", file=sys.stderr)
+                continue
+
+            f.write(json_dumps(doc) + "\n")
+
+            done.add(qid)
+            state_log.append(qid)
+
+            unflushed += 1
+            if unflushed >= FLUSH_EVERY:
+                f.flush()
+                state_log.sync()
+                unflushed = 0
+
+            written += 1
+            if handled % 50 == 0:
+                print(f"[{handled}/{total}] written={written} skipped={skipped} failed={failed}")
+
+        f.flush()
+    state_log.sync()
+    return written, failed
+
+
+async def crawl(
+    pending: List[str],
+    out_path: Path,
+    raw_dir: Path,
+    state_log: StateLog,
+    done: Set[str],
+    total: int,
+    skipped: int,
+    rps: float,
+    concurrency: int,
+) -> Tuple[int, int]:
+    concurrency = max(1, concurrency)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    limiter = RateLimiter(rps)
+
+    connector = aiohttp.TCPConnector(limit_per_host=concurrency)
+    async with aiohttp.ClientSession(connector=connector, headers={"User-Agent": USER_AGENT}) as session:
+        writer = asyncio.create_task(write_results(results, out_path, state_log, done, total, skipped))
+        workers = [
+            asyncio.create_task(fetch_worker(queue, results, session, limiter, raw_dir))
+            for _ in range(concurrency)
+        ]
+
+        async def feed() -> None:
+            for qid in pending:
+                await queue.put(qid)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            await results.put(None)
+
+        # If the writer dies, workers would block forever on the bounded results queue:
+        # watch all tasks, cancel the rest and re-raise on the first failure.
+        done, waiting = await asyncio.wait(
+            {asyncio.create_task(feed()), writer, *workers}, return_when=asyncio.FIRST_EXCEPTION
+        )
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+        for task in done:
+            task.result()
+        return writer.result()
 
 
 def main():
@@ -199,6 +457,12 @@ def main():
     ap.add_argument("--state-file", default="data/state/done_qids.json")
     ap.add_argument("--max", type=int, default=0)
     ap.add_argument("--rps", type=float, default=1.0, help="Target requests per second (default 1.0).")
+    ap.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Max in-flight requests (default {DEFAULT_CONCURRENCY}).",
+    )
     args = ap.parse_args()
 
     qids: List[str] = []
@@ -231,57 +495,28 @@ def main():
 
     state_file = Path(args.state_file)
     done = load_state(state_file)
-
-    session = requests.Session()
-    session.headers.update({"User-Agent": USER_AGENT})
-
-    interval = 1.0 / max(args.rps, 0.1)
-
-    written = 0
-    skipped = 0
-    failed = 0
-
-    with out_path.open("a", encoding="utf-8") as f:
-        for idx, qid in enumerate(uniq, 1):
-            if qid in done:
-                skipped += 1
-                continue
-
-            t0 = time.time()
-            try:
-                raw_path = raw_dir / f"{qid}.json"
-                if raw_path.exists():
-                    payload = json.loads(raw_path.read_text(encoding="utf-8"))
-                else:
-                    payload = fetch_entity_with_backoff(qid, session=session)
-                    raw_path.write_text(json.dumps(payload), encoding="utf-8")
-
-                entity = payload.get("entities", {}).get(qid)
-                if not isinstance(entity, dict):
-                    raise RuntimeError("Missing entity in response")
-
-                doc = normalize_entity_to_rag_doc(qid, entity)
-                f.write(json.dumps(doc, ensure_ascii=False) + "\n")
-                f.flush()
-
-                done.add(qid)
-                if len(done) % 25 == 0:
-                    save_state(state_file, done)
-
-                written += 1
-                if idx % 50 == 0:
-                    print(f"[{idx}/{len(uniq)}] written={written} skipped={skipped} failed={failed}")
-
-            except Exception as e:
-                failed += 1
-                print(f"FAILED {qid}: {e}", file=sys.stderr)
-
-            # rate limit to target rps
-            elapsed = time.time() - t0
-            sleep_for = interval - elapsed
-            if sleep_for > 0:
-                time.sleep(sleep_for)
-
+    # Start from a compact log (also migrates the old JSON-list format).
+    save_state(state_file, done)
+    state_log = StateLog(state_file)
+
+    pending = [qid for qid in uniq if qid not in done]
+    skipped = len(uniq) - len(pending)
+
+    written, failed = asyncio.run(
+        crawl(
+            pending,
+            out_path=out_path,
+            raw_dir=raw_dir,
+            state_log=state_log,
+            done=done,
+            total=len(uniq),
+            skipped=skipped,
+            rps=args.rps,
+            concurrency=args.concurrency,
+        )
+    )
+
+    state_log.close()
     save_state(state_file, done)
     print(f"Done. total_unique={len(uniq)} written={written} skipped={skipped} failed={failed}")
     print(f"Resume state saved to: {state_file}")
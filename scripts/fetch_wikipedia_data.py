@@ -11,7 +11,8 @@ Uses MediaWiki API (full page extract as plain text):
   https://en.wikipedia.org/w/api.php?action=query&prop=extracts&explaintext=1&exsectionformat=wiki...
 
 Features:
-- rate limiting (requests/sec)
+- concurrent async fetches (aiohttp) under a shared rate limit (requests/sec)
+- titles batched TITLES_PER_REQUEST per API query (one cache file per title)
 - retries + exponential backoff (handles 429/5xx)
 - resume via state file
 - safe title parsing from wikipedia URL
@@ -21,38 +22,76 @@ Features:
 from __future__ import annotations
 
 import argparse
+import asyncio
 import json
+import os
 import random
 import re
 import sys
 import time
 import urllib.parse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Set
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
 
-import requests
+import aiohttp
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
 
 USER_AGENT = "GioBirdRAG/0.1 (local educational project)"
 
 # MediaWiki API endpoint
 MEDIAWIKI_API = "https://en.wikipedia.org/w/api.php"
 
+_NEWLINE_RE = re.compile(r"\n{3,}")
+_SAFE_KEY_RE = re.compile(r"[^a-zA-Z0-9._-]+")
+
 DEFAULT_CHUNK_CHARS = 1600
 DEFAULT_CHUNK_OVERLAP = 200
+DEFAULT_CONCURRENCY = 32
+# MediaWiki accepts up to 20 titles per prop=extracts query (exlimit max for non-bots).
+TITLES_PER_REQUEST = 20
+# Threads for reading + parsing cached pages; cache hits are not rate limited.
+CACHE_READ_WORKERS = 32
+# Output/state lines buffered between flushes (+ state fsync) in the writer.
+FLUSH_EVERY = 100
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def json_dumps(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False)
+
 
+def json_dumps_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
 
-def load_jsonl(path: Path) -> Iterable[Dict[str, Any]]:
-    with path.open("r", encoding="utf-8") as f:
+
+def load_jsonl(path: Path, follow: bool = False) -> Iterable[Dict[str, Any]]:
+    """
+    With `follow`, the file is still being appended to: a last line without its newline
+    is half-written, so it is skipped (and reported) for the next run to pick up.
+    """
+    with path.open("rb") as f:
         for line in f:
+            if follow and not line.endswith(b"\n"):
+                print(f"Skipped {len(line)} trailing bytes (incomplete last line) in {path}")
+                break
             line = line.strip()
             if not line:
                 continue
-            yield json.loads(line)
-
-
-def append_jsonl(path: Path, obj: Dict[str, Any]) -> None:
-    with path.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+            yield json_loads(line)
 
 
 def wikipedia_title_from_url(url: str) -> Optional[str]:
@@ -65,74 +104,151 @@ def wikipedia_title_from_url(url: str) -> Optional[str]:
 
 
 def safe_cache_key(title: str) -> str:
-    key = re.sub(r"[^a-zA-Z0-9._-]+", "_", title)
+    key = _SAFE_KEY_RE.sub("_", title)
     return key[:180]
 
 
 def load_state(state_file: Path) -> Set[str]:
+    """
+    Reads the done-log (one id per line). State files from before the append-only
+    format are a single JSON list and are still accepted.
+
+    A crash can leave a torn last line (possibly cut inside a multi-byte character);
+    it is dropped, and the id simply gets redone. A file that cannot be read at all
+    exits instead of returning an empty set, which the startup compaction would
+    otherwise write over the log.
+    """
     if not state_file.exists():
         return set()
-    try:
-        data = json.loads(state_file.read_text(encoding="utf-8"))
-        if isinstance(data, list):
-            return set(x for x in data if isinstance(x, str))
-    except Exception:
-        pass
-    return set()
+    data = state_file.read_bytes()
+    if data.lstrip().startswith(b"["):
+        try:
+            items = json_loads(data)
+        except ValueError as e:
+            print(f"Unreadable state file {state_file}: {e}", file=sys.stderr)
+            sys.exit(1)
+        return set(x for x in items if isinstance(x, str)) if isinstance(items, list) else set()
+
+    lines = data.split(b"\n")
+    lines.pop()  # "" after the final newline, or the torn last line
+    done = set()
+    for line in lines:
+        key = line.decode("utf-8", errors="replace").strip()
+        if key:
+            done.add(key)
+    return done
 
 
 def save_state(state_file: Path, done: Set[str]) -> None:
+    """
+    Compacts the done-log: rewrites it as one deduped id per line, atomically.
+    """
     state_file.parent.mkdir(parents=True, exist_ok=True)
-    state_file.write_text(json.dumps(sorted(done)), encoding="utf-8")
+    tmp = state_file.with_name(state_file.name + ".tmp")
+    tmp.write_text("".join(f"{x}\n" for x in sorted(done)), encoding="utf-8")
+    os.replace(tmp, state_file)
+
+
+class StateLog:
+    """
+    Append-only done-log: each finished id costs one short write instead of
+    re-serializing the whole set. The writer calls sync() right after flushing the
+    output those ids refer to, so the log never runs ahead of the data on disk.
+    """
+
+    def __init__(self, state_file: Path) -> None:
+        state_file.parent.mkdir(parents=True, exist_ok=True)
+        self.f = state_file.open("a", encoding="utf-8")
+
+    def append(self, key: str) -> None:
+        self.f.write(key + "\n")
+
+    def sync(self) -> None:
+        self.f.flush()
+        os.fsync(self.f.fileno())
 
+    def close(self) -> None:
+        self.sync()
+        self.f.close()
 
-def fetch_with_backoff(session: requests.Session, params: Dict[str, Any], max_retries: int = 8) -> Dict[str, Any]:
+
+class RateLimiter:
+    """
+    Token bucket shared by all fetch workers, so the aggregate request rate stays at `rps`
+    no matter how many requests are in flight.
+    """
+
+    def __init__(self, rps: float, burst: int = 1) -> None:
+        self.rate = max(rps, 0.1)
+        self.capacity = float(max(burst, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+
+async def fetch_with_backoff_async(
+    session: aiohttp.ClientSession,
+    params: Dict[str, Any],
+    limiter: RateLimiter,
+    max_retries: int = 8,
+) -> Dict[str, Any]:
     backoff = 1.0
     last_status = None
 
     for _ in range(max_retries + 1):
-        r = session.get(MEDIAWIKI_API, params=params, timeout=45)
-        last_status = r.status_code
+        await limiter.acquire()
+        async with session.get(MEDIAWIKI_API, params=params, timeout=aiohttp.ClientTimeout(total=45)) as r:
+            last_status = r.status
 
-        if r.status_code == 200:
-            return r.json()
+            if r.status == 200:
+                return await r.json(content_type=None, loads=json_loads)
+
+            if r.status not in (429, 502, 503, 504):
+                r.raise_for_status()
+                continue
 
-        if r.status_code in (429, 502, 503, 504):
             retry_after = r.headers.get("Retry-After")
-            if retry_after:
-                try:
-                    wait = float(retry_after)
-                except ValueError:
-                    wait = backoff
-            else:
-                wait = backoff
 
-            wait = wait + random.random() * 0.6
-            time.sleep(wait)
-            backoff = min(backoff * 2, 60.0)
-            continue
+        if retry_after:
+            try:
+                wait = float(retry_after)
+            except ValueError:
+                wait = backoff
+        else:
+            wait = backoff
 
-        r.raise_for_status()
+        wait = wait + random.random() * 0.6
+        await asyncio.sleep(wait)
+        backoff = min(backoff * 2, 60.0)
 
     raise RuntimeError(f"Exceeded retries (last_status={last_status})")
 
 
 def chunk_text(text: str, chunk_chars: int, overlap: int) -> List[str]:
-    text = re.sub(r"\n{3,}", "\n\n", text.strip())
-    if not text:
-        return []
-    chunks: List[str] = []
-    start = 0
+    text = _NEWLINE_RE.sub("\n\n", text.strip())
     n = len(text)
-    while start < n:
-        end = min(start + chunk_chars, n)
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        if end >= n:
-            break
-        start = max(0, end - overlap)
-    return chunks
+    if not n:
+        return []
+    step = chunk_chars - overlap
+    if step <= 0:
+        raise ValueError(f"overlap ({overlap}) must be smaller than chunk_chars ({chunk_chars})")
+
+    # Chunk i spans [i*step, i*step + chunk_chars); the last chunk is the first one reaching n.
+    count = 1 + max(0, -(-(n - chunk_chars) // step))
+    starts = np.arange(count, dtype=np.int64) * step
+    ends = np.minimum(starts + chunk_chars, n)
+    return [text[s:e] for s, e in zip(starts.tolist(), ends.tolist())]
 
 
 def extract_plaintext_from_mediawiki(payload: Dict[str, Any]) -> Tuple[Optional[str], Optional[str], Optional[str], bool]:
@@ -147,9 +263,9 @@ def extract_plaintext_from_mediawiki(payload: Dict[str, Any]) -> Tuple[Optional[
     if not isinstance(pages, dict) or not pages:
         return None, None, None, False
 
-    # There is typically one page entry keyed by pageid
-    page = next(iter(pages.values()))
-    if not isinstance(page, dict):
+    # Cached payloads hold the single page their title resolved to; skip malformed entries.
+    page = next((p for p in pages.values() if isinstance(p, dict)), None)
+    if page is None:
         return None, None, None, False
 
     title = page.get("title") if isinstance(page.get("title"), str) else None
@@ -166,6 +282,329 @@ def extract_plaintext_from_mediawiki(payload: Dict[str, Any]) -> Tuple[Optional[
     return title, page_url, extract, is_disambig
 
 
+def write_atomic(path: Path, data: bytes) -> None:
+    """
+    Writes via a temp file + rename, so an interrupted write never leaves a truncated file behind.
+    """
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def read_cached_payload(cache_path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        data = cache_path.read_bytes()
+    except FileNotFoundError:
+        return None
+    try:
+        return json_loads(data)
+    except ValueError:
+        # Truncated/corrupt cache file: treat as a miss so the page is re-fetched and rewritten.
+        return None
+
+
+def resolve_title(title: str, normalized: Dict[str, str], redirects: Dict[str, str]) -> str:
+    """
+    Follows MediaWiki's normalized -> redirects mapping from an input title to the page title.
+    """
+    title = normalized.get(title, title)
+    seen: Set[str] = set()
+    while title in redirects and title not in seen:
+        seen.add(title)
+        title = redirects[title]
+    return title
+
+
+async def fetch_pages(
+    titles: List[str],
+    session: aiohttp.ClientSession,
+    limiter: RateLimiter,
+    stats: Counter,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetches up to TITLES_PER_REQUEST titles in one query and returns {input title: payload},
+    each payload a single-page response in the same shape as the per-title cache files.
+
+    TextExtracts only returns one full-page extract per response, so the query is followed
+    through its `continue` markers and page fields are merged across responses.
+    """
+    # Full plaintext extract (single long string)
+    params = {
+        "action": "query",
+        "format": "json",
+        "redirects": 1,
+        "prop": "extracts|pageprops",
+        "explaintext": 1,
+        "exsectionformat": "wiki",
+        "exlimit": TITLES_PER_REQUEST,
+        "titles": "|".join(titles),
+    }
+    pages: Dict[str, Dict[str, Any]] = {}
+    normalized: Dict[str, str] = {}
+    redirects: Dict[str, str] = {}
+    cont: Dict[str, Any] = {}
+    while True:
+        payload = await fetch_with_backoff_async(session, {**params, **cont}, limiter)
+        stats["requests"] += 1
+        query = payload.get("query")
+        if isinstance(query, dict):
+            for m in query.get("normalized") or []:
+                normalized[m["from"]] = m["to"]
+            for m in query.get("redirects") or []:
+                redirects[m["from"]] = m["to"]
+            for page in (query.get("pages") or {}).values():
+                if isinstance(page, dict) and isinstance(page.get("title"), str):
+                    pages.setdefault(page["title"], {}).update(page)
+        cont = payload.get("continue")
+        if not isinstance(cont, dict):
+            break
+
+    out: Dict[str, Dict[str, Any]] = {}
+    for title in titles:
+        page = pages.get(resolve_title(title, normalized, redirects))
+        page_key = str(page.get("pageid", -1)) if page else None
+        out[title] = {"query": {"pages": {page_key: page} if page else {}}}
+    return out
+
+
+def build_chunk_docs(
+    qid: str,
+    wiki_url: str,
+    title_in_url: str,
+    payload: Dict[str, Any],
+    chunk_chars: int,
+    overlap: int,
+    stats: Counter,
+) -> List[Dict[str, Any]]:
+    title, page_url, extract_text, is_disambig = extract_plaintext_from_mediawiki(payload)
+
+    if is_disambig:
+        stats["disambig"] += 1
+        return []
+
+    if not isinstance(extract_text, str) or not extract_text.strip():
+        stats["no_text"] += 1
+        return []
+
+    chunks = chunk_text(extract_text, chunk_chars, overlap)
+    if not chunks:
+        stats["no_text"] += 1
+        return []
+
+    return [
+        {
+            "doc_id": f"{qid}:wikipedia_full:{j}",
+            "species_id": qid,
+            "source": "wikipedia",
+            "title": title or title_in_url.replace("_", " "),
+            "url": page_url or wiki_url,
+            "section": "full_page_extract",
+            "text": chunk,
+            "license_note": "Wikipedia text is CC BY-SA; include attribution via URL."
+        }
+        for j, chunk in enumerate(chunks)
+    ]
+
+
+async def fetch_worker(
+    queue: "asyncio.Queue[Optional[List[Tuple[str, str, str]]]]",
+    results: "asyncio.Queue[Optional[Tuple[str, List[Dict[str, Any]], Optional[Path], Dict[str, Any]]]]",
+    session: aiohttp.ClientSession,
+    limiter: RateLimiter,
+    cache_dir: Path,
+    cache_pool: ThreadPoolExecutor,
+    chunk_chars: int,
+    overlap: int,
+    stats: Counter,
+) -> None:
+    """
+    Takes groups of up to TITLES_PER_REQUEST titles: cache hits are served from disk, the
+    misses go out as one batched query. Each result carries its cache path only for a fresh
+    fetch; the writer persists it, so workers never write files themselves.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        group = await queue.get()
+        if group is None:
+            return
+
+        cache_paths = [cache_dir / f"{safe_cache_key(title_in_url)}.json" for _, _, title_in_url in group]
+        # Warm re-runs are pure disk reads; do them on the pool so many overlap
+        # instead of blocking the event loop one file at a time.
+        cached = await asyncio.gather(
+            *(loop.run_in_executor(cache_pool, read_cached_payload, path) for path in cache_paths),
+            return_exceptions=True,
+        )
+        misses = [title_in_url for (_, _, title_in_url), payload in zip(group, cached) if payload is None]
+        fetched: Dict[str, Dict[str, Any]] = {}
+        if misses:
+            try:
+                fetched = await fetch_pages(misses, session, limiter, stats)
+            except Exception as e:
+                # Only the misses are lost; cache hits in the same group are still written.
+                for qid, _, title_in_url in group:
+                    if title_in_url in misses:
+                        stats["failed"] += 1
+                        print(f"FAILED {qid} ({title_in_url}): {e}", file=sys.stderr)
+
+        for (qid, wiki_url, title_in_url), cache_path, payload in zip(group, cache_paths, cached):
+            if isinstance(payload, BaseException):
+                stats["failed"] += 1
+                print(f"FAILED {qid} ({title_in_url}): {payload}", file=sys.stderr)
+                continue
+            new_cache_path: Optional[Path] = None
+            if payload is None:
+                if title_in_url not in fetched:
+                    continue
+                payload = fetched[title_in_url]
+                new_cache_path = cache_path
+                stats["fetched"] += 1
+            else:
+                stats["cached"] += 1
+            try:
+                docs = build_chunk_docs(qid, wiki_url, title_in_url, payload, chunk_chars, overlap, stats)
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"FAILED {qid} ({title_in_url}): {e}", file=sys.stderr)
+                continue
+            await results.put((title_in_url, docs, new_cache_path, payload))
+
+
+async def write_results(
+    results: "asyncio.Queue[Optional[Tuple[str, List[Dict[str, Any]], Optional[Path], Dict[str, Any]]]]",
+    out_path: Path,
+    state_log: StateLog,
+    done_titles: Set[str],
+    stats: Counter,
+) -> None:
+    """
+    Single writer: the only coroutine touching the output JSONL, the page cache and
+    the state file, so chunks from different pages are never interleaved. Keeps one
+    output handle open and flushes every FLUSH_EVERY lines. Progress is reported here,
+    after pages are handled, so the counters are not ahead of the output.
+    """
+    unflushed = 0
+    with out_path.open("a", encoding="utf-8") as out_fh:
+        while True:
+            item = await results.get()
+            if item is None:
+                break
+            title_in_url, docs, cache_path, payload = item
+
+            try:
+                if cache_path is not None:
+                    write_atomic(cache_path, json_dumps_bytes(payload))
+                out_fh.write("".join(json_dumps(doc) + "\n" for doc in docs))
+            except Exception as e:
+                # One page's failure (e.g. its cache write) must not take down the writer.
+                stats["failed"] += 1
+                print(f"FAILED ({title_in_url}): {e}", file=sys.stderr)
+                continue
+            stats["chunks"] += len(docs)
+
+            done_titles.add(title_in_url)
+            state_log.append(title_in_url)
+            stats["handled"] += 1
+            if stats["handled"] % 50 == 0:
+                print_progress(stats)
+
+            unflushed += len(docs) + 1
+            if unflushed >= FLUSH_EVERY:
+                out_fh.flush()
+                state_log.sync()
+                unflushed = 0
+
+        out_fh.flush()
+    state_log.sync()
+
+
+def print_progress(stats: Counter) -> None:
+    print(
+        f"[{stats['handled']}/{stats['processed']}] fetched={stats['fetched']} cached={stats['cached']} requests={stats['requests']} "
+        f"no_wiki={stats['no_wiki']} disambig={stats['disambig']} "
+        f"no_text={stats['no_text']} failed={stats['failed']} chunks={stats['chunks']}"
+    )
+
+
+async def crawl(
+    args: argparse.Namespace,
+    in_path: Path,
+    out_path: Path,
+    cache_dir: Path,
+    state_log: StateLog,
+    done_titles: Set[str],
+    stats: Counter,
+) -> None:
+    concurrency = max(1, args.concurrency)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    limiter = RateLimiter(args.rps)
+    queued: Set[str] = set()
+
+    connector = aiohttp.TCPConnector(limit_per_host=concurrency)
+    async with aiohttp.ClientSession(connector=connector, headers={"User-Agent": USER_AGENT}) as session:
+        cache_pool = ThreadPoolExecutor(max_workers=CACHE_READ_WORKERS)
+        writer = asyncio.create_task(write_results(results, out_path, state_log, done_titles, stats))
+        workers = [
+            asyncio.create_task(
+                fetch_worker(
+                    queue, results, session, limiter, cache_dir, cache_pool, args.chunk_chars, args.overlap, stats
+                )
+            )
+            for _ in range(concurrency)
+        ]
+
+        async def feed() -> None:
+            group: List[Tuple[str, str, str]] = []
+            for bird in load_jsonl(in_path, follow=args.follow):
+                if args.max and stats["processed"] >= args.max:
+                    break
+                stats["processed"] += 1
+
+                qid = bird.get("doc_id") or bird.get("qid") or bird.get("id")
+                wiki_url = (bird.get("external_links") or {}).get("wikipedia")
+                if not isinstance(qid, str):
+                    continue
+
+                if not isinstance(wiki_url, str) or not wiki_url:
+                    stats["no_wiki"] += 1
+                    continue
+
+                title_in_url = wikipedia_title_from_url(wiki_url)
+                if not title_in_url:
+                    stats["no_wiki"] += 1
+                    continue
+
+                if title_in_url in done_titles or title_in_url in queued:
+                    continue
+
+                queued.add(title_in_url)
+                group.append((qid, wiki_url, title_in_url))
+                if len(group) == TITLES_PER_REQUEST:
+                    await queue.put(group)
+                    group = []
+
+            if group:
+                await queue.put(group)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            await results.put(None)
+
+        # Watch every task: if the writer (or a worker) dies, the others would block forever
+        # on the bounded queues, so cancel them and re-raise instead.
+        tasks = {asyncio.create_task(feed()), writer, *workers}
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in done:
+                task.result()
+        finally:
+            cache_pool.shutdown()
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--in", dest="in_path", default="data/processed/birds.jsonl")
@@ -173,7 +612,18 @@ def main():
     ap.add_argument("--cache-dir", default="data/raw/wikipedia_full")
     ap.add_argument("--state-file", default="data/state/wiki_full_done_titles.json")
     ap.add_argument("--rps", type=float, default=0.5, help="Start lower for full pages.")
+    ap.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Max in-flight requests (default {DEFAULT_CONCURRENCY}).",
+    )
     ap.add_argument("--max", type=int, default=0)
+    ap.add_argument(
+        "--follow",
+        action="store_true",
+        help="Input is still being written: leave an incomplete last line for the next run.",
+    )
     ap.add_argument("--chunk-chars", type=int, default=DEFAULT_CHUNK_CHARS)
     ap.add_argument("--overlap", type=int, default=DEFAULT_CHUNK_OVERLAP)
     args = ap.parse_args()
@@ -187,130 +637,30 @@ def main():
         print(f"Missing input JSONL: {in_path}", file=sys.stderr)
         sys.exit(1)
 
+    # Checked up front: otherwise every page would be fetched under the rate limit and then fail chunking.
+    if args.overlap >= args.chunk_chars:
+        print(f"--overlap ({args.overlap}) must be smaller than --chunk-chars ({args.chunk_chars})", file=sys.stderr)
+        sys.exit(1)
+
     out_path.parent.mkdir(parents=True, exist_ok=True)
     cache_dir.mkdir(parents=True, exist_ok=True)
 
     done_titles = load_state(state_file)
+    # Start from a compact log (also migrates the old JSON-list format).
+    save_state(state_file, done_titles)
+    state_log = StateLog(state_file)
+    stats: Counter = Counter()
 
-    session = requests.Session()
-    session.headers.update({"User-Agent": USER_AGENT})
-
-    interval = 1.0 / max(args.rps, 0.1)
-
-    processed = 0
-    fetched = 0
-    cached = 0
-    skipped_no_wiki = 0
-    skipped_disambig = 0
-    skipped_no_text = 0
-    failed = 0
-    written_chunks = 0
-
-    for bird in load_jsonl(in_path):
-        if args.max and processed >= args.max:
-            break
-        processed += 1
-
-        qid = bird.get("doc_id") or bird.get("qid") or bird.get("id")
-        wiki_url = (bird.get("external_links") or {}).get("wikipedia")
-        if not isinstance(qid, str):
-            continue
-
-        if not isinstance(wiki_url, str) or not wiki_url:
-            skipped_no_wiki += 1
-            continue
-
-        title_in_url = wikipedia_title_from_url(wiki_url)
-        if not title_in_url:
-            skipped_no_wiki += 1
-            continue
-
-        if title_in_url in done_titles:
-            continue
-
-        t0 = time.time()
-        try:
-            cache_key = safe_cache_key(title_in_url)
-            cache_path = cache_dir / f"{cache_key}.json"
-
-            if cache_path.exists():
-                payload = json.loads(cache_path.read_text(encoding="utf-8"))
-                cached += 1
-            else:
-                # Full plaintext extract (single long string)
-                params = {
-                    "action": "query",
-                    "format": "json",
-                    "redirects": 1,
-                    "prop": "extracts|pageprops",
-                    "explaintext": 1,
-                    "exsectionformat": "wiki",
-                    "titles": title_in_url,
-                }
-                payload = fetch_with_backoff(session, params=params)
-                cache_path.write_text(json.dumps(payload), encoding="utf-8")
-                fetched += 1
-
-            title, page_url, extract_text, is_disambig = extract_plaintext_from_mediawiki(payload)
-
-            if is_disambig:
-                skipped_disambig += 1
-                done_titles.add(title_in_url)
-                continue
-
-            if not isinstance(extract_text, str) or not extract_text.strip():
-                skipped_no_text += 1
-                done_titles.add(title_in_url)
-                continue
-
-            chunks = chunk_text(extract_text, args.chunk_chars, args.overlap)
-            if not chunks:
-                skipped_no_text += 1
-                done_titles.add(title_in_url)
-                continue
-
-            for j, chunk in enumerate(chunks):
-                doc = {
-                    "doc_id": f"{qid}:wikipedia_full:{j}",
-                    "species_id": qid,
-                    "source": "wikipedia",
-                    "title": title or title_in_url.replace("_", " "),
-                    "url": page_url or wiki_url,
-                    "section": "full_page_extract",
-                    "text": chunk,
-                    "license_note": "Wikipedia text is CC BY-SA; include attribution via URL."
-                }
-                append_jsonl(out_path, doc)
-                written_chunks += 1
-
-            done_titles.add(title_in_url)
-            if len(done_titles) % 25 == 0:
-                save_state(state_file, done_titles)
-
-        except Exception as e:
-            failed += 1
-            print(f"FAILED {qid} ({title_in_url}): {e}", file=sys.stderr)
-
-        # rate limit
-        elapsed = time.time() - t0
-        sleep_for = interval - elapsed
-        if sleep_for > 0:
-            time.sleep(sleep_for)
-
-        if processed % 50 == 0:
-            print(
-                f"[{processed}] fetched={fetched} cached={cached} "
-                f"no_wiki={skipped_no_wiki} disambig={skipped_disambig} "
-                f"no_text={skipped_no_text} failed={failed} chunks={written_chunks}"
-            )
+    asyncio.run(crawl(args, in_path, out_path, cache_dir, state_log, done_titles, stats))
 
+    state_log.close()
     save_state(state_file, done_titles)
     print("Done.")
-    print(f"Processed birds: {processed}")
-    print(f"Fetched: {fetched}  Cached: {cached}")
-    print(f"Skipped: no_wiki={skipped_no_wiki} disambig={skipped_disambig} no_text={skipped_no_text}")
-    print(f"Failed: {failed}")
-    print(f"Wrote chunks: {written_chunks}")
+    print(f"Processed birds: {stats['processed']}")
+    print(f"Fetched: {stats['fetched']} ({stats['requests']} requests)  Cached: {stats['cached']}")
+    print(f"Skipped: no_wiki={stats['no_wiki']} disambig={stats['disambig']} no_text={stats['no_text']}")
+    print(f"Failed: {stats['failed']}")
+    print(f"Wrote chunks: {stats['chunks']}")
     print(f"Output: {out_path}")
     print(f"State: {state_file}")
     print(f"Cache: {cache_dir}")
@@ -1,25 +1,52 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
-import json
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import faiss
+import numpy as np
 from fastapi import FastAPI, Query
 from pydantic import BaseModel
 from sentence_transformers import SentenceTransformer
 
+try:
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+except ImportError:  # pragma: no cover - int8 ONNX encoder is optional
+    ORTModelForFeatureExtraction = None
+
 INDEX_DIR = Path("data/index")
-FAISS_PATH = INDEX_DIR / "faiss.index"
-META_PATH = INDEX_DIR / "chunks.jsonl"
+SHARD_GLOB = "faiss.shard*.index"
+META_DB_PATH = INDEX_DIR / "chunks.sqlite"
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# Written by export_onnx_encoder.py; used instead of MODEL_NAME when present.
+ONNX_ENCODER_DIR = INDEX_DIR / "encoder-onnx"
+ONNX_ENCODER_FILE = "model_quantized.onnx"
+# Matches SentenceTransformer's max_seq_length for MiniLM-L6 and the index build default.
+MAX_SEQ_LENGTH = 256
+# Inverted lists scanned per query when the index is IVF (ignored for flat indexes).
+NPROBE = 16
+# Concurrent /search calls are coalesced into one encode + search of up to
+# BATCH_MAX queries, waiting at most BATCH_WAIT_S for the batch to fill.
+BATCH_MAX = 32
+BATCH_WAIT_S = 0.010
+# Normalized query vectors kept for repeat queries (~1.5 KB each at dim 384).
+QUERY_CACHE_SIZE = 4096
 
 app = FastAPI(title="Bird RAG Retrieval (Local)")
 
 index = None
-meta: List[Dict[str, Any]] = []
+meta_db: Optional[sqlite3.Connection] = None
+# Lookups run on executor threads; the shared read-only connection is used by one at a time.
+meta_lock = threading.Lock()
 model = None
+query_cache: Optional["QueryCache"] = None
+batcher: Optional["QueryBatcher"] = None
 
 
 class SearchResult(BaseModel):
@@ -38,36 +65,250 @@ class SearchResponse(BaseModel):
     results: List[SearchResult]
 
 
+def read_shard(path: Path) -> faiss.Index:
+    """
+    Memory-maps a shard so pages are read on demand instead of copied into RSS. IVF
+    indexes (fourcc "Iw..") map their inverted lists with IO_FLAG_MMAP; flat-code
+    indexes (the fp16 --exact / small-corpus build) need IO_FLAG_MMAP_IFC, which only
+    exists from faiss 1.10. On older faiss those shards are loaded fully into memory.
+    """
+    with path.open("rb") as f:
+        fourcc = f.read(4)
+    if fourcc.startswith(b"Iw"):
+        flags = faiss.IO_FLAG_MMAP
+    else:
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    return faiss.read_index(str(path), flags | faiss.IO_FLAG_READ_ONLY)
+
+
+def read_meta(ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Fetches metadata rows for the search hits only, keyed by FAISS row id.
+    """
+    assert meta_db is not None
+    if not ids:
+        return {}
+    placeholders = ",".join("?" * len(ids))
+    with meta_lock:
+        cur = meta_db.execute(
+            f"SELECT row_id, doc_id, species_id, title, url, section, text FROM chunks WHERE row_id IN ({placeholders})",
+            ids,
+        )
+        return {row["row_id"]: dict(row) for row in cur}
+
+
+class OnnxEncoder:
+    """
+    int8 ONNX Runtime version of SentenceTransformer.encode for MiniLM: tokenize,
+    mean-pool over the attention mask, L2-normalize. Output is fp32 (n, dim), the same
+    geometry the index was built with.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.tokenizer = AutoTokenizer.from_pretrained(str(path))
+        self.model = ORTModelForFeatureExtraction.from_pretrained(str(path), file_name=ONNX_ENCODER_FILE)
+
+    def encode(self, texts: List[str], batch_size: int = 32, normalize_embeddings: bool = False) -> np.ndarray:
+        out = []
+        for i in range(0, len(texts), batch_size):
+            enc = self.tokenizer(
+                texts[i : i + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=MAX_SEQ_LENGTH,
+                return_tensors="np",
+            )
+            hidden = self.model(**enc).last_hidden_state
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            emb = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                emb = emb / np.clip(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12, None)
+            out.append(emb.astype(np.float32))
+        return np.concatenate(out)
+
+
+def load_encoder():
+    if ORTModelForFeatureExtraction is not None and (ONNX_ENCODER_DIR / ONNX_ENCODER_FILE).exists():
+        print(f"Using int8 ONNX encoder from {ONNX_ENCODER_DIR}")
+        return OnnxEncoder(ONNX_ENCODER_DIR)
+    encoder = SentenceTransformer(MODEL_NAME)
+    encoder.max_seq_length = MAX_SEQ_LENGTH
+    return encoder
+
+
+class QueryCache:
+    """
+    LRU of fp32 query vectors keyed by the raw query string, stored as bytes.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.data: "OrderedDict[str, bytes]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, q: str) -> Optional[np.ndarray]:
+        with self.lock:
+            buf = self.data.get(q)
+            if buf is None:
+                return None
+            self.data.move_to_end(q)
+        return np.frombuffer(buf, dtype=np.float32)
+
+    def put(self, q: str, vec: np.ndarray) -> None:
+        with self.lock:
+            self.data[q] = vec.astype(np.float32).tobytes()
+            self.data.move_to_end(q)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+
+def embed_queries(queries: List[str]) -> np.ndarray:
+    """
+    Query vectors for a batch, running the encoder only on queries not in the cache.
+    """
+    assert model is not None and query_cache is not None
+    vecs: Dict[str, np.ndarray] = {}
+    misses: List[str] = []
+    for q in dict.fromkeys(queries):
+        vec = query_cache.get(q)
+        if vec is None:
+            misses.append(q)
+        else:
+            vecs[q] = vec
+
+    if misses:
+        encoded = model.encode(misses, batch_size=len(misses), normalize_embeddings=True).astype("float32")
+        for q, vec in zip(misses, encoded):
+            query_cache.put(q, vec)
+            vecs[q] = vec
+
+    return np.stack([vecs[q] for q in queries])
+
+
+def encode_and_search(queries: List[str], k: int) -> Tuple[np.ndarray, np.ndarray, Dict[int, Dict[str, Any]]]:
+    """
+    Encode, search and metadata lookup for a whole batch; runs on a worker thread.
+    """
+    assert index is not None
+    scores, ids = index.search(embed_queries(queries), k)
+    rows = read_meta(sorted({int(i) for i in ids.ravel() if i >= 0}))
+    return scores, ids, rows
+
+
+class QueryBatcher:
+    """
+    Collects queries from concurrent requests and runs them through the encoder (cache
+    misses only), FAISS and the metadata lookup as one batch on a worker thread, so the
+    event loop never blocks on any of them.
+    """
+
+    def __init__(self, max_batch: int, max_wait: float) -> None:
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def search(self, q: str, k: int) -> Tuple[List[float], List[int], Dict[int, Dict[str, Any]]]:
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((q, k, fut))
+        return await fut
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            queries = [q for q, _, _ in batch]
+            # Results come back sorted by score, so one search at the largest k
+            # serves every request in the batch.
+            max_k = max(k for _, k, _ in batch)
+            try:
+                scores, ids, rows = await loop.run_in_executor(None, encode_and_search, queries, max_k)
+            except Exception as e:
+                for _, _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            for i, (_, k, fut) in enumerate(batch):
+                if not fut.done():
+                    fut.set_result((scores[i, :k].tolist(), ids[i, :k].tolist(), rows))
+
+
 @app.on_event("startup")
 def load_all():
-    global index, meta, model
-    if not FAISS_PATH.exists() or not META_PATH.exists():
+    global index, meta_db, model, query_cache
+    shard_paths = sorted(INDEX_DIR.glob(SHARD_GLOB))
+    if not shard_paths or not META_DB_PATH.exists():
         raise RuntimeError("Missing FAISS index or metadata. Run build_faiss_index.py first.")
 
-    index = faiss.read_index(str(FAISS_PATH))
+    # Shards are searched in parallel threads; successive_ids maps each shard's
+    # local ids back to global row ids in build order.
+    index = None
+    for path in shard_paths:
+        shard = read_shard(path)
+        try:
+            faiss.extract_index_ivf(shard).nprobe = NPROBE
+        except RuntimeError:
+            pass  # built with --exact
+        if index is None:
+            index = faiss.IndexShards(shard.d, True, True)
+        index.add_shard(shard)
+
+    meta_db = sqlite3.connect(f"{META_DB_PATH.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+    meta_db.row_factory = sqlite3.Row
+    (meta_rows,) = meta_db.execute("SELECT COUNT(*) FROM chunks").fetchone()
+
+    model = load_encoder()
+    # Fresh cache per model load; vectors from a different encoder must not leak in.
+    query_cache = QueryCache(QUERY_CACHE_SIZE)
+    print(f"Loaded index with {index.ntotal} vectors and {meta_rows} metadata rows.")
+
+
+@app.on_event("startup")
+async def start_batcher():
+    global batcher
+    batcher = QueryBatcher(BATCH_MAX, BATCH_WAIT_S)
+    batcher.start()
 
-    with META_PATH.open("r", encoding="utf-8") as f:
-        meta = [json.loads(line) for line in f if line.strip()]
 
-    model = SentenceTransformer(MODEL_NAME)
-    print(f"Loaded index with {index.ntotal} vectors and {len(meta)} metadata rows.")
+@app.on_event("shutdown")
+async def stop_batcher():
+    if batcher is not None:
+        await batcher.stop()
 
 
 @app.get("/search", response_model=SearchResponse)
-def search(
+async def search(
     q: str = Query(..., min_length=1),
     k: int = Query(5, ge=1, le=20),
 ):
-    assert index is not None and model is not None
+    assert batcher is not None
 
-    vec = model.encode([q], normalize_embeddings=True).astype("float32")
-    scores, ids = index.search(vec, k)
+    scores, ids, rows = await batcher.search(q, k)
 
     results: List[SearchResult] = []
-    for score, idx in zip(scores[0].tolist(), ids[0].tolist()):
-        if idx < 0 or idx >= len(meta):
+    for score, idx in zip(scores, ids):
+        row = rows.get(idx)
+        if row is None:
             continue
-        row = meta[idx]
         results.append(
             SearchResult(
                 doc_id=row.get("doc_id"),
@@ -2,14 +2,106 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import subprocess
 import sys
 from pathlib import Path
-
-
-def run(cmd: list[str]) -> None:
-    print("\n" + " ".join(cmd))
-    subprocess.run(cmd, check=True)
+from typing import Callable, List, Optional
+
+# How often a downstream stage checks its upstream's output file for new lines.
+POLL_S = 2.0
+
+
+async def run_stage(cmd: List[str]) -> None:
+    print("\n" + " ".join(cmd), flush=True)
+    proc = await asyncio.create_subprocess_exec(*cmd)
+    try:
+        rc = await proc.wait()
+    except asyncio.CancelledError:
+        proc.terminate()
+        await proc.wait()
+        raise
+    if rc != 0:
+        raise subprocess.CalledProcessError(rc, cmd)
+
+
+class LineCounter:
+    """
+    Counts lines in a file that is still being appended to, reading only the new tail on each poll.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.offset = 0
+        self.lines = 0
+
+    def poll(self) -> int:
+        if self.path.exists():
+            with self.path.open("rb") as f:
+                f.seek(self.offset)
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    self.offset += len(block)
+                    self.lines += block.count(b"\n")
+        return self.lines
+
+
+async def follow(
+    upstream: Optional[asyncio.Task],
+    watch_path: Path,
+    min_growth: int,
+    make_cmd: Callable[[int, bool], List[str]],
+) -> None:
+    """
+    Runs a resumable stage each time its upstream's output grows by min_growth lines, then once
+    more after upstream finishes so the last rows are picked up. With no upstream it runs once.
+    make_cmd gets the run number and whether upstream is still writing (-> --follow).
+    """
+    counter = LineCounter(watch_path)
+    seen = 0
+    runs = 0
+    while upstream is not None and not upstream.done():
+        if counter.poll() - seen >= min_growth:
+            seen = counter.lines
+            await run_stage(make_cmd(runs, True))
+            runs += 1
+        else:
+            await asyncio.sleep(POLL_S)
+    if upstream is not None:
+        await upstream  # re-raises if upstream failed
+    await run_stage(make_cmd(runs, False))
+
+
+async def run_pipeline(
+    birds_cmd: Optional[List[str]],
+    wiki_cmd: Optional[List[str]],
+    index_cmd: Optional[Callable[[int, bool], List[str]]],
+    args: argparse.Namespace,
+) -> None:
+    """
+    Overlaps the three stages: wikipedia starts on the first birds while wikidata is still
+    fetching, and the index is built incrementally (--append) from chunks as they land.
+    """
+    tasks: List[asyncio.Task] = []
+    birds = wiki = None
+    if birds_cmd is not None:
+        birds = asyncio.create_task(run_stage(birds_cmd))
+        tasks.append(birds)
+    if wiki_cmd is not None:
+
+        def make_wiki_cmd(run_no: int, live: bool) -> List[str]:
+            return wiki_cmd + ["--follow"] if live else wiki_cmd
+
+        wiki = asyncio.create_task(follow(birds, Path(args.birds_out), args.follow_min_birds, make_wiki_cmd))
+        tasks.append(wiki)
+    if index_cmd is not None:
+        tasks.append(asyncio.create_task(follow(wiki, Path(args.wiki_out), args.follow_min_chunks, index_cmd)))
+
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for task in done:
+        task.result()
 
 
 def main() -> None:
@@ -34,11 +126,25 @@ def main() -> None:
     ap.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
     ap.add_argument("--batch-size", type=int, default=64)
     ap.add_argument("--min-chars", type=int, default=200)
+    ap.add_argument("--exact", action="store_true", help="Build a brute-force fp16 index instead of IVFPQ.")
 
     ap.add_argument("--skip-wikidata", action="store_true")
     ap.add_argument("--skip-wikipedia", action="store_true")
     ap.add_argument("--skip-index", action="store_true")
 
+    ap.add_argument(
+        "--follow-min-birds",
+        type=int,
+        default=50,
+        help="Re-run the wikipedia stage after this many new wikidata rows while wikidata is still running.",
+    )
+    ap.add_argument(
+        "--follow-min-chunks",
+        type=int,
+        default=1024,
+        help="Re-run the index stage (--append) after this many new chunks while wikipedia is still running.",
+    )
+
     args = ap.parse_args()
 
     qid_files = list(Path().glob(args.qids_glob))
@@ -46,8 +152,11 @@ def main() -> None:
         print(f"No QID files found for glob: {args.qids_glob}")
         sys.exit(1)
 
+    birds_cmd = wiki_cmd = None
+    index_cmd = None
+
     if not args.skip_wikidata:
-        cmd = [
+        birds_cmd = [
             sys.executable,
             "scripts/fetch_wikidata_birds.py",
             "--out",
@@ -60,12 +169,11 @@ def main() -> None:
             str(args.rps_wikidata),
         ]
         if args.max:
-            cmd += ["--max", str(args.max)]
-        cmd += ["--wdqs-json", *[str(p) for p in qid_files]]
-        run(cmd)
+            birds_cmd += ["--max", str(args.max)]
+        birds_cmd += ["--wdqs-json", *[str(p) for p in qid_files]]
 
     if not args.skip_wikipedia:
-        cmd = [
+        wiki_cmd = [
             sys.executable,
             "scripts/fetch_wikipedia_data.py",
             "--in",
@@ -84,25 +192,35 @@ def main() -> None:
             str(args.overlap),
         ]
         if args.max:
-            cmd += ["--max", str(args.max)]
-        run(cmd)
+            wiki_cmd += ["--max", str(args.max)]
 
     if not args.skip_index:
-        cmd = [
-            sys.executable,
-            "scripts/build_faiss_index.py",
-            "--in",
-            args.wiki_out,
-            "--out-dir",
-            args.index_dir,
-            "--model",
-            args.model,
-            "--batch-size",
-            str(args.batch_size),
-            "--min-chars",
-            str(args.min_chars),
-        ]
-        run(cmd)
+
+        def index_cmd(run_no: int, live: bool) -> List[str]:
+            # The first run rebuilds from scratch; follow-up runs only embed new chunks.
+            cmd = [
+                sys.executable,
+                "scripts/build_faiss_index.py",
+                "--in",
+                args.wiki_out,
+                "--out-dir",
+                args.index_dir,
+                "--model",
+                args.model,
+                "--batch-size",
+                str(args.batch_size),
+                "--min-chars",
+                str(args.min_chars),
+            ]
+            if args.exact:
+                cmd.append("--exact")
+            if run_no > 0:
+                cmd.append("--append")
+            if live:
+                cmd.append("--follow")
+            return cmd
+
+    asyncio.run(run_pipeline(birds_cmd, wiki_cmd, index_cmd, args))
 
 
 if __name__ == "__main__":
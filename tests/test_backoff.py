@@ -0,0 +1,65 @@
+"""
+Regression test: a 429 backoff must only delay its own fetch, not the whole crawl.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+import fetch_wikidata_birds  # noqa: E402
+
+N_TASKS = 50
+RETRY_AFTER_S = 1.0
+
+
+async def run_crawl(monkeypatch) -> float:
+    throttled = set()
+
+    async def entity(request: web.Request) -> web.Response:
+        qid = request.match_info["qid"]
+        # Every other QID gets exactly one 429 before succeeding.
+        if int(qid[1:]) % 2 == 0 and qid not in throttled:
+            throttled.add(qid)
+            return web.Response(status=429, headers={"Retry-After": str(RETRY_AFTER_S)})
+        return web.json_response({"entities": {qid: {"id": qid}}})
+
+    app = web.Application()
+    app.router.add_get("/entity/{qid}.json", entity)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    monkeypatch.setattr(fetch_wikidata_birds, "ENTITY_URL", f"http://127.0.0.1:{port}/entity/{{qid}}.json")
+    limiter = fetch_wikidata_birds.RateLimiter(1000.0, burst=N_TASKS)
+    try:
+        async with aiohttp.ClientSession() as session:
+            start = time.monotonic()
+            payloads = await asyncio.gather(
+                *(
+                    fetch_wikidata_birds.fetch_entity_with_backoff_async(f"Q{i}", session, limiter)
+                    for i in range(1, N_TASKS + 1)
+                )
+            )
+            elapsed = time.monotonic() - start
+    finally:
+        await runner.cleanup()
+
+    assert len(throttled) == N_TASKS // 2
+    assert [p["entities"] for p in payloads] == [{f"Q{i}": {"id": f"Q{i}"}} for i in range(1, N_TASKS + 1)]
+    return elapsed
+
+
+def test_concurrent_429s_cost_one_backoff(monkeypatch):
+    elapsed = asyncio.run(run_crawl(monkeypatch))
+    # One Retry-After plus at most 0.5 s jitter; sequential backoffs would take ~25 s.
+    assert elapsed < RETRY_AFTER_S + 0.5 + 2.0